@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# Benchmarks for gifts.find_gifts.
+#
+# Times every backend on the real LOVED_GIFTS, on seeded synthetic gift
+# tables, and on tables extended with the modded JsonAssets catalogs in
+# the save folders, then checks that the optimal covers of LOVED_GIFTS
+# still match FULL_OUTPUT.  The golden check runs for every backend, even
+# above --max-combinations; with --no-golden it is skipped and the exit
+# status is 1, so 0 always means every backend matched.  For example:
+#
+#   python bench_gifts.py --backends bnb,bitmask > bench_output.txt
+
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import gifts
+
+# Brute-force backends are skipped on tables that would need more
+# combinations than this.
+MAX_COMBINATIONS = 5_000_000
+
+
+def synthetic_table(npcs, num_gifts, density, seed=0):
+    """
+    A gift table where each of npcs people loves each of num_gifts gifts
+    with probability density, and everyone loves at least one gift.
+    """
+    rng = random.Random(seed)
+    names = [f'gift {i}' for i in range(num_gifts)]
+    table = {}
+    for i in range(npcs):
+        loved = [gift for gift in names if rng.random() < density]
+        table[f'npc {i}'] = loved or [rng.choice(names)]
+    return table
+
+
+def modded_table(catalog_path, density, seed=0):
+    """
+    LOVED_GIFTS with each person also loving every item of a JsonAssets
+    catalog (ids-objects.json) with probability density.
+    """
+    rng = random.Random(seed)
+    with open(catalog_path, encoding='utf-8-sig') as f:
+        items = sorted(gifts.normalize(name) for name in json.load(f))
+    return {
+        person: loved + [item for item in items if rng.random() < density]
+        for person, loved in gifts.LOVED_GIFTS.items()
+    }
+
+
+def datasets(args):
+    """Yield (name, table) for every table to benchmark."""
+    yield 'loved', gifts.LOVED_GIFTS
+    for npcs in args.npcs:
+        for num_gifts in args.gifts:
+            for density in args.densities:
+                name = f'synthetic npcs={npcs} gifts={num_gifts} density={density}'
+                yield name, synthetic_table(npcs, num_gifts, density, args.seed)
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(args.root, '*', 'JsonAssets', 'ids-objects.json'))):
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        # Most saves share the same mod list.
+        if digest in seen:
+            continue
+        seen.add(digest)
+        for density in args.densities:
+            yield f'modded {os.path.basename(os.path.dirname(os.path.dirname(path)))} density={density}', modded_table(path, density, args.seed)
+
+
+def sweep_size(table):
+    """
+    Number of combinations the brute-force backends evaluate on table,
+    which is every combination of 2 up to the minimum cover size.
+    """
+    names, people, masks, singletons = gifts._reduce_gifts(table)
+    found = gifts.find_gifts(table)
+    size = len(found[0]) - len(singletons) if found else len(names)
+    return sum(math.comb(len(names), n) for n in range(2, size + 1))
+
+
+def run(table, backend, workers, measure_memory):
+    """
+    Run find_gifts once and return (found, seconds, peak bytes or None,
+    stats).  The peak is measured in a second, traced run, and does not
+    include worker processes.
+    """
+    stats = gifts.SolveStats()
+    options = {'backend': backend, 'workers': workers}
+    start = time.perf_counter()
+    found = gifts.find_gifts(table, stats=stats, **options)
+    seconds = time.perf_counter() - start
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        gifts.find_gifts(table, **options)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return found, seconds, peak, stats
+
+
+def golden_covers():
+    """The optimal covers printed at the end of FULL_OUTPUT."""
+    return ast.literal_eval(gifts.FULL_OUTPUT.strip().splitlines()[-1])
+
+
+def same_covers(found, expected, table=gifts.LOVED_GIFTS):
+    """
+    Whether two lists of covers are the same sets of gifts.
+
+    Gifts loved by exactly the same people are interchangeable: which
+    one survives pruning depends on set iteration order, so each gift
+    is compared by the people who love it.
+    """
+    lovers = {}
+    for person, loved_gifts in table.items():
+        for gift in loved_gifts:
+            lovers.setdefault(gift, set()).add(person)
+
+    def key(cover):
+        return frozenset(
+            frozenset(lovers.get(gift) or {gift.strip('<>').rsplit(' gift', 1)[0]}) for gift in cover
+        )
+
+    return {key(cover) for cover in found} == {key(cover) for cover in expected}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark gifts.find_gifts backends.')
+    parser.add_argument('--backends', default='bnb,bitmask,sets',
+                        help='comma-separated find_gifts backends (default: %(default)s)')
+    parser.add_argument('--workers', type=int, nargs='*', default=[],
+                        help="also run the 'bitmask' backend with these worker counts")
+    parser.add_argument('--npcs', type=int, nargs='*', default=[10, 20, 34])
+    parser.add_argument('--gifts', type=int, nargs='*', default=[50, 150])
+    parser.add_argument('--densities', type=float, nargs='*', default=[0.03, 0.08])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--root', default=os.path.dirname(os.path.abspath(__file__)),
+                        help='folder holding the save folders')
+    parser.add_argument('--max-combinations', type=int, default=MAX_COMBINATIONS,
+                        help='skip brute-force backends above this many combinations')
+    parser.add_argument('--no-golden', action='store_true',
+                        help='skip brute-force backends on LOVED_GIFTS too (exits 1)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run for peak memory')
+    args = parser.parse_args(argv)
+
+    runs = [(backend, None) for backend in args.backends.split(',')]
+    runs.extend(('bitmask', workers) for workers in args.workers)
+    golden = golden_covers()
+    ok = True
+    print(f"{'dataset':<60} {'backend':<10} {'seconds':>9} {'peak KiB':>9} {'evals':>11} {'evals/s':>11}  result")
+    for name, table in datasets(args):
+        combinations = sweep_size(table)
+        for backend, workers in runs:
+            label = backend if workers is None else f'{backend}/{workers}'
+            too_big = backend != 'bnb' and combinations > args.max_combinations
+            if too_big and (name != 'loved' or args.no_golden):
+                skipped = f'skipped: {combinations} combinations'
+                if name == 'loved':
+                    ok = False
+                    skipped += ', golden check skipped'
+                print(f'{name:<60} {label:<10} {skipped}')
+                continue
+            found, seconds, peak, stats = run(table, backend, workers, not args.no_memory)
+            evaluations = stats.evaluated
+            result = f'{len(found)} covers'
+            if name == 'loved':
+                matches = same_covers(found, golden)
+                ok = ok and matches
+                result += ', matches FULL_OUTPUT' if matches else ', DOES NOT MATCH FULL_OUTPUT'
+            peak = f'{peak // 1024:>9}' if peak is not None else f"{'-':>9}"
+            print(f'{name:<60} {label:<10} {seconds:>9.3f} {peak} {evaluations:>11} {evaluations / seconds:>11.0f}  {result}')
+            sys.stdout.flush()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
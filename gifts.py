@@ -1,8 +1,23 @@
 #!/usr/bin/env python
 
+from collections import namedtuple
 from pprint import pprint
+import concurrent.futures
+import functools
+import heapq
 import itertools
+import json
 import logging
+import math
+import multiprocessing
+import operator
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
@@ -44,60 +59,153 @@ LOVED_GIFTS = {
     'willy': ['catfish', 'diamond', 'gold bar', 'iridium bar', 'jewels of the sea', 'mead', 'octopus', 'pumpkin', 'sea cucumber', 'sturgeon', 'the art o crabbing'],
 }
 
+# Gifts every villager loves in stardew 1.6, and the villagers who are
+# the exception.
+UNIVERSAL_LOVES = ['golden pumpkin', 'magic rock candy', 'pearl', 'prismatic shard', 'rabbits foot', 'stardrop tea']
+UNIVERSAL_LOVE_EXCEPTIONS = {
+    'haley': ['prismatic shard'],
+    'penny': ['rabbits foot'],
+}
+
+# Compact gift index: people are bit positions in the order of people,
+# and tiers maps a tier name ('loved', 'liked', ...) to a dict of gift
+# -> bitmask of the people in that tier for it.
+GiftIndex = namedtuple('GiftIndex', 'people tiers')
 
 
-def find_gifts(all_gifts=LOVED_GIFTS):
+def normalize(name):
+    """Turn an in-game name like "Farmer's Lunch" into a LOVED_GIFTS key."""
+    return ' '.join(name.lower().replace("'", '').replace(',', '').replace('.', '').split())
+
+
+def build_gift_index(tables=None, universal=None, exceptions=None, catalogs=()):
     """
-    This method finds a set cover (https://en.wikipedia.org/wiki/Set_cover_problem):
+    Build a GiftIndex in one pass over the gift tables.
 
-    Near-optimal solutions are available (https://github.com/guangtunbenzhu/SetCoverPy).
+    tables maps tier names to tables shaped like LOVED_GIFTS (default:
+    {'loved': LOVED_GIFTS}).  universal maps tier names to gifts that
+    everyone has in that tier, except the people listing them in
+    exceptions, e.g. universal={'loved': UNIVERSAL_LOVES},
+    exceptions=UNIVERSAL_LOVE_EXCEPTIONS.
 
-    This method uses a brute-force approach as there are 143 subsets.
+    catalogs are JsonAssets files such as ids-objects.json.  They only
+    name the modded items, so each item is added to every tier with an
+    empty mask unless a table or universal list already gives it one;
+    modded tastes come in through tables.
+    """
+    tables = {'loved': LOVED_GIFTS} if tables is None else tables
+    universal = universal or {}
+    exceptions = exceptions or {}
+    people = sorted({person for table in tables.values() for person in table})
+    bit = {person: 1 << i for i, person in enumerate(people)}
+    excluded = {}
+    for person, gifts in exceptions.items():
+        for gift in gifts:
+            excluded[gift] = excluded.get(gift, 0) | bit.get(person, 0)
 
-    Used code from: https://stackoverflow.com/a/21975926
+    tiers = {}
+    for tier in [*tables, *(tier for tier in universal if tier not in tables)]:
+        masks = tiers[tier] = {}
+        for person, gifts in tables.get(tier, {}).items():
+            for gift in gifts:
+                masks[gift] = masks.get(gift, 0) | bit[person]
+        for gift in universal.get(tier, ()):
+            masks[gift] = masks.get(gift, 0) | ((1 << len(people)) - 1) & ~excluded.get(gift, 0)
+
+    for path in catalogs:
+        with open(path, encoding='utf-8-sig') as f:
+            items = [normalize(name) for name in json.load(f)]
+        for masks in tiers.values():
+            for item in items:
+                masks.setdefault(item, 0)
+    return GiftIndex(people, tiers)
+
+
+def index_table(index, tier='loved'):
     """
-    all_people = set(all_gifts.keys())
-    reverse_all_gifts = {}
-    for person, loved_gifts in all_gifts.items():
-        for loved_gift in set(loved_gifts):
-            reverse_all_gifts[loved_gift] = {person, *reverse_all_gifts.get(loved_gift, set())}
+    The table of one tier of index, shaped like LOVED_GIFTS, for use with
+    find_gifts and the other functions taking all_gifts.
+    """
+    table = {person: [] for person in index.people}
+    for gift, mask in index.tiers[tier].items():
+        while mask:
+            low = mask & -mask
+            table[index.people[low.bit_length() - 1]].append(gift)
+            mask ^= low
+    return table
+
+
+def save_gift_index(index, path):
+    """Write index to path as JSON."""
+    with open(path, 'w') as f:
+        json.dump({'people': index.people, 'tiers': index.tiers}, f, separators=(',', ':'))
+
+
+def load_gift_index(path):
+    """Read an index written by save_gift_index()."""
+    with open(path) as f:
+        data = json.load(f)
+    return GiftIndex(data['people'], data['tiers'])
+
+
+def _reduce_gifts(all_gifts, stats=None, tier='loved'):
+    """
+    Prune the gift masks of all_gifts, which is either a table shaped
+    like LOVED_GIFTS or a GiftIndex whose tier is used as is.
+
+    Gifts loved by a single person and gifts dominated by another gift
+    are removed, and counted in stats.pruned_gifts if stats is given.
+    People left without any shared gift get a placeholder singleton
+    gift instead.
+
+    Returns (gifts, people, masks, singletons): the gifts left, the
+    people who share them, masks[i] the bitmask over people of the
+    people who love gifts[i], and the placeholder -> {person} mapping.
+    """
+    index = all_gifts if isinstance(all_gifts, GiftIndex) else build_gift_index({tier: all_gifts})
+    all_people = index.people
+    gift_masks = {gift: mask for gift, mask in index.tiers[tier].items() if mask}
+    num_gifts = len(gift_masks)
 
     ######################################################################
     # Prune singletons                                                   #
     ######################################################################
-    seen_people = set()
-    for gift, people in list(reverse_all_gifts.items()):
-        if len(people) == 1:
+    seen_people = 0
+    for gift, mask in list(gift_masks.items()):
+        if mask & (mask - 1) == 0:
             # Prune singleton list.
-            print(f'Pruning {gift} as only {people} loves it.')
-            del reverse_all_gifts[gift]
+            LOG.info('Pruning %s as only %s loves it.', gift, {all_people[mask.bit_length() - 1]})
+            del gift_masks[gift]
         else:
-            seen_people.update(people)
+            seen_people |= mask
     singletons = {}
-    people_needing_singletons = set()
-    for person in all_people:
-        if person not in seen_people:
-            people_needing_singletons.add(person)
+    for i, person in enumerate(all_people):
+        if not seen_people >> i & 1:
             # gift = all_gifts[person][0]
             gift = f'<{person} gift>'
-            print(f'Found that {person} only had singleton gifts.  Using {gift}.')
+            LOG.info('Found that %s only had singleton gifts.  Using %s.', person, gift)
             singletons[gift] = {person}
 
-    gift_people = all_people - people_needing_singletons
-
-    # O(people * people * gifts) time to preprocess, very cheap
-    # compared to exponential.
-    for gift, people in list(reverse_all_gifts.items()):
-        for other_gift, other_people in list(reverse_all_gifts.items()):
-            if gift != other_gift and people <= other_people:
-                # gift is dominated by other_gift
-                print(f'Pruned {gift} as it is dominated by {other_gift}')
-                # Even if we prune other_gift later, then it itself
-                # was dominated by another gift, so it's ok to prune
-                # gift
-                del reverse_all_gifts[gift]
-                # Already pruned this gift, consider pruning next gift.
+    # Visiting masks by decreasing popcount, a gift is dominated if one
+    # of the undominated masks found so far covers it, as those cover
+    # everything else seen.  Such a mask also has the gift's person with
+    # the fewest undominated masks, so only that person's bucket is
+    # scanned.  Among equal masks the first one is kept.
+    buckets = [[] for _ in all_people]
+    dominated = {}
+    for gift, mask in sorted(gift_masks.items(), key=lambda item: -item[1].bit_count()):
+        bits = [i for i in range(mask.bit_length()) if mask >> i & 1]
+        for other_gift, other_mask in buckets[min(bits, key=lambda i: len(buckets[i]))]:
+            if mask & other_mask == mask:
+                dominated[gift] = other_gift
                 break
+        else:
+            for i in bits:
+                buckets[i].append((gift, mask))
+    for gift in list(gift_masks):
+        if gift in dominated:
+            LOG.info('Pruned %s as it is dominated by %s', gift, dominated[gift])
+            del gift_masks[gift]
 
     # Doubleton pruning is wrong, the general form of singleton
     # pruning is dominated set pruning.
@@ -107,12 +215,12 @@ def find_gifts(all_gifts=LOVED_GIFTS):
     ######################################################################
     # doubleton_seen_people = set()
     # doubletons = {}
-    # for gift, people in list(reverse_all_gifts.items()):
+    # for gift, people in list(gift_masks.items()):
     #     if len(people) == 2:
     #         # Prune doubleton list.
     #         print(f'Pruning {gift} as only {people} love it.')
     #         doubletons[gift] = people
-    #         del reverse_all_gifts[gift]
+    #         del gift_masks[gift]
     #     else:
     #         doubleton_seen_people.update(people)
     # people_needing_doubletons = set()
@@ -141,15 +249,142 @@ def find_gifts(all_gifts=LOVED_GIFTS):
 
     # gift_people = gift_people - people_needing_doubletons
 
+    if stats is not None:
+        stats.pruned_gifts += num_gifts - len(gift_masks)
+    # Renumber the people who share gifts as bits 0, 1, ...
+    positions = [i for i in range(len(all_people)) if seen_people >> i & 1]
+    people = [all_people[i] for i in positions]
+    masks = [
+        sum(1 << bit for bit, i in enumerate(positions) if mask >> i & 1)
+        for mask in gift_masks.values()
+    ]
+    return list(gift_masks), people, masks, singletons
+
+
+# Seconds between progress() calls during find_gifts().
+PROGRESS_INTERVAL = 0.5
+# Combinations the 'sets' backend evaluates between checks of the
+# deadline.
+CHECK_INTERVAL = 1 << 12
+
+
+class SolveStats:
+    """
+    Counters and bounds for a find_gifts() run, updated as it searches.
+
+    pruned_gifts counts the gifts removed before the search.  evaluated
+    counts combinations for the sweep backends and search nodes for
+    'bnb'.  level_seconds maps each n swept by the sweep backends to
+    the seconds spent on combinations of n gifts.
+
+    lower_bound and upper_bound bracket the size of a minimum cover,
+    counting singleton gifts like the covers find_gifts() returns.
+    complete is set when the search ran to the end and lower_bound
+    proves the returned covers minimal.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clear the counters and bounds, as find_gifts() does on entry."""
+        self.pruned_gifts = 0
+        self.evaluated = 0
+        self.level_seconds = {}
+        self.lower_bound = 0
+        self.upper_bound = None
+        self.elapsed = 0.0
+        self.complete = False
+
+    @property
+    def gap(self):
+        """upper_bound - lower_bound, or None before any cover is known."""
+        if self.upper_bound is None:
+            return None
+        return self.upper_bound - self.lower_bound
+
+    def __repr__(self):
+        return (
+            f'SolveStats(pruned_gifts={self.pruned_gifts}, evaluated={self.evaluated}, '
+            f'lower_bound={self.lower_bound}, upper_bound={self.upper_bound}, gap={self.gap}, '
+            f'elapsed={self.elapsed:.3f}, complete={self.complete})'
+        )
+
+
+class _Monitor:
+    """
+    Keeps a SolveStats up to date for a search, calls progress, and
+    tells the search when to stop.
+
+    Bounds are passed in without the offset singleton gifts, which are
+    added back here.
+    """
+
+    def __init__(self, stats, offset=0, deadline=None, progress=None, cancel=None):
+        self.stats = stats
+        self.offset = offset
+        self.deadline = deadline
+        self.progress = progress
+        self.cancel = cancel
+        self.start = time.monotonic()
+        self.next_progress = self.start + PROGRESS_INTERVAL
+        self.stopped = False
+
+    def bounds(self, lower=None, upper=None):
+        if lower is not None:
+            self.stats.lower_bound = max(self.stats.lower_bound, lower + self.offset)
+        if upper is not None:
+            self.stats.upper_bound = upper + self.offset
+
+    def level(self, n, evaluated, seconds):
+        """Record a level of a sweep backend."""
+        self.stats.level_seconds[n] = seconds
+        LOG.debug('Evaluated %d combinations of %d gifts in %.3fs', evaluated, n, seconds)
+
+    def stop(self):
+        """Whether the search should stop now, calling progress if it is due."""
+        if self.stopped:
+            return True
+        now = time.monotonic()
+        self.stats.elapsed = now - self.start
+        if self.progress is not None and now >= self.next_progress:
+            self.next_progress = now + PROGRESS_INTERVAL
+            self.progress(self.stats)
+        if (self.deadline is not None and now >= self.deadline) or (self.cancel is not None and self.cancel.is_set()):
+            LOG.info('Stopping the search after %.3fs with a gap of %s', self.stats.elapsed, self.stats.gap)
+            self.stopped = True
+        return self.stopped
+
+
+def _brute_force_covers(gifts, people, masks, monitor):
+    """
+    Find every minimum cover of people by trying all combinations of n
+    gifts for increasing n, with the people of each gift as a set.
+
+    Stops early, returning the covers found so far, when monitor says
+    so.
+
+    Used code from: https://stackoverflow.com/a/21975926
+    """
+    reverse_all_gifts = {
+        gift: {person for i, person in enumerate(people) if mask >> i & 1} for gift, mask in zip(gifts, masks)
+    }
+    gift_people = set(people)
     found = []
     # Tuple (n, k, sets) where n is the number of people requiring
     # singleton gifts, k is the number of non-singleton gifts, and
     # sets is a list of the near-cover sets containing singletons for
     # those people.
     max_near_cover = (len(gift_people), 0, [tuple(f'<{person} gift>' for person in gift_people)])
+    stats = monitor.stats
     for n in range(2, len(reverse_all_gifts)):
-        print(f"Trying combinations of {n} gifts out of {len(reverse_all_gifts)}")
+        LOG.info('Trying combinations of %d gifts out of %d', n, len(reverse_all_gifts))
+        start = time.perf_counter()
+        evaluated = stats.evaluated
         for gift_combo in itertools.combinations(reverse_all_gifts.keys(), n):
+            if not stats.evaluated % CHECK_INTERVAL and monitor.stop():
+                break
+            stats.evaluated += 1
             u = set().union(*[reverse_all_gifts[gift] for gift in gift_combo])
             if gift_people <= u:
                 found.append(gift_combo)
@@ -157,18 +392,500 @@ def find_gifts(all_gifts=LOVED_GIFTS):
                 max_near_cover = (len(gift_people - u), n, [gift_combo + tuple(f'<{person} gift>' for person in gift_people - u)])
             elif len(gift_people - u) + n == max_near_cover[0] + max_near_cover[1] and n <= max_near_cover[1]:
                 max_near_cover[2].append(gift_combo + tuple(f'<{person} gift>' for person in gift_people - u))
-        if found:
+        monitor.level(n, stats.evaluated - evaluated, time.perf_counter() - start)
+        if found or monitor.stopped:
             break
         else:
+            # A smaller cover plus any other gift would have been found.
+            monitor.bounds(lower=n + 1)
             if max_near_cover[1] < n:
-                print(f"No more efficient gift combos found at {n} gifts.")
+                LOG.info('No more efficient gift combos found at %d gifts.', n)
             else:
-                print(f"For combinations of {max_near_cover[1]} gifts, the most efficient combos covered all but {max_near_cover[0]} people: {max_near_cover[2]}")
+                LOG.info('For combinations of %d gifts, the most efficient combos covered all but %d people: %s', max_near_cover[1], max_near_cover[0], max_near_cover[2])
+
+    return found
+
+
+def _lower_bound(uncovered, allowed, masks, candidates):
+    """
+    Lower bound on the number of allowed gifts needed to cover the
+    uncovered people (bitmasks), or None if they cannot be covered.
+
+    Takes the best of two bounds: a packing of people whose candidate
+    gifts are pairwise disjoint (each needs its own gift), and the LP
+    dual bound where each person is charged 1 / (size of the largest
+    gift covering them).
+    """
+    packing = 0
+    used = 0
+    dual = 0.0
+    for person, person_gifts in enumerate(candidates):
+        if not uncovered >> person & 1:
+            continue
+        person_gifts &= allowed
+        if not person_gifts:
+            return None
+        if not person_gifts & used:
+            packing += 1
+            used |= person_gifts
+        largest = max(
+            (masks[gift] & uncovered).bit_count()
+            for gift in range(len(masks)) if person_gifts >> gift & 1
+        )
+        dual += 1 / largest
+    return max(packing, math.ceil(dual - 1e-9))
+
+
+def _greedy_cover(full, masks):
+    """Greedy cover of the people in full, as a list of gift indices."""
+    cover = []
+    uncovered = full
+    while uncovered:
+        gift = max(range(len(masks)), key=lambda g: (masks[g] & uncovered).bit_count())
+        cover.append(gift)
+        uncovered &= ~masks[gift]
+    return cover
+
+
+def _branch_and_bound_covers(gifts, people, masks, monitor):
+    """
+    Find every minimum cover of people with an exact branch-and-bound
+    search over the gift masks.
+
+    Each node branches on the uncovered person with the fewest
+    remaining candidate gifts.  The i-th branch takes that person's
+    i-th candidate and excludes the earlier ones, so every cover is
+    reached exactly once.  The greedy cover seeds the upper bound and
+    _lower_bound() cuts the branches that cannot tie the best cover.
+
+    When monitor stops the search, the covers tied for the best size
+    found so far are returned, or none if the greedy cover is still the
+    best.
+    """
+    candidates = _candidate_masks(masks, len(people))
+    full = (1 << len(people)) - 1
+    every_gift = (1 << len(gifts)) - 1
+    stats = monitor.stats
+
+    best = [len(_greedy_cover(full, masks))]
+    found = []
+
+    def search(chosen, uncovered, allowed):
+        if monitor.stop():
+            return
+        stats.evaluated += 1
+        if not uncovered:
+            if len(chosen) < best[0]:
+                best[0] = len(chosen)
+                found.clear()
+                monitor.bounds(upper=best[0])
+            found.append(tuple(sorted(chosen)))
+            return
+        bound = _lower_bound(uncovered, allowed, masks, candidates)
+        if bound is None or len(chosen) + bound > best[0]:
+            return
+        for gift in _branch_options(uncovered, allowed, masks, candidates):
+            allowed &= ~(1 << gift)
+            chosen.append(gift)
+            search(chosen, uncovered & ~masks[gift], allowed)
+            chosen.pop()
+
+    search([], full, every_gift)
+    if not monitor.stopped:
+        monitor.bounds(lower=best[0])
+    # Same order as the combinations sweep in _brute_force_covers().
+    return [tuple(gifts[g] for g in combo) for combo in sorted(found)]
+
+
+def _candidate_masks(masks, num_people):
+    """For each person, the bitmask of the gifts that cover them."""
+    return [
+        sum(1 << g for g, mask in enumerate(masks) if mask >> p & 1)
+        for p in range(num_people)
+    ]
+
+
+def _branch_options(uncovered, allowed, masks, candidates):
+    """
+    The allowed gifts covering the uncovered person with the fewest of
+    them, most useful first.
+    """
+    person = min(
+        (p for p in range(len(candidates)) if uncovered >> p & 1),
+        key=lambda p: (candidates[p] & allowed).bit_count(),
+    )
+    options = [g for g in range(len(masks)) if (candidates[person] & allowed) >> g & 1]
+    options.sort(key=lambda g: -(masks[g] & uncovered).bit_count())
+    return options
+
+
+def _iter_covers_of_size(masks, candidates, full, size):
+    """
+    Yield every cover of full using at most size gifts, as lists of
+    gift indices, with the same branching and bounds as
+    _branch_and_bound_covers().  Only the current branch is kept in
+    memory.
+    """
+    def search(chosen, uncovered, allowed):
+        if not uncovered:
+            yield chosen
+            return
+        bound = _lower_bound(uncovered, allowed, masks, candidates)
+        if bound is None or len(chosen) + bound > size:
+            return
+        for gift in _branch_options(uncovered, allowed, masks, candidates):
+            allowed &= ~(1 << gift)
+            chosen.append(gift)
+            yield from search(chosen, uncovered & ~masks[gift], allowed)
+            chosen.pop()
+
+    return search([], full, (1 << len(masks)) - 1)
+
+
+# Number of combinations evaluated per batch by the bitmask backend.
+BATCH_SIZE = 1 << 16
+
+
+def _int_batches(masks, full, n, prefix=()):
+    """
+    Yield (combos, uncovered, counts) batches for every combination of
+    n gifts starting with the gift indices in prefix, using Python ints
+    as bitmasks.
+    """
+    start = prefix[-1] + 1 if prefix else 0
+    covered = functools.reduce(operator.or_, (masks[g] for g in prefix), 0)
+    combos = zip(
+        itertools.combinations(range(start, len(masks)), n - len(prefix)),
+        itertools.combinations(masks[start:], n - len(prefix)),
+    )
+    while True:
+        batch = list(itertools.islice(combos, BATCH_SIZE))
+        if not batch:
+            return
+        uncovered = [full & ~functools.reduce(operator.or_, combo_masks, covered) for _, combo_masks in batch]
+        yield [prefix + combo for combo, _ in batch], uncovered, [u.bit_count() for u in uncovered]
+
+
+def _numpy_batches(masks, full, n, prefix=()):
+    """
+    Yield (combos, uncovered, counts) batches for every combination of
+    n gifts starting with the gift indices in prefix, OR-reducing uint64
+    masks a whole batch at a time.
+    """
+    masks = np.array(masks, dtype=np.uint64)
+    full = np.uint64(full)
+    start = prefix[-1] + 1 if prefix else 0
+    rest = n - len(prefix)
+    covered = np.bitwise_or.reduce(masks[list(prefix)]) if prefix else np.uint64(0)
+    combos = itertools.combinations(range(start, len(masks)), rest)
+    while True:
+        if rest:
+            flat = np.fromiter(
+                itertools.chain.from_iterable(itertools.islice(combos, BATCH_SIZE)), dtype=np.intp
+            )
+            if not flat.size:
+                return
+            batch = flat.reshape(-1, rest)
+        elif next(combos, None) is not None:
+            batch = np.empty((1, 0), dtype=np.intp)
+        else:
+            return
+        uncovered = full & ~(covered | np.bitwise_or.reduce(masks[batch], axis=1))
+        if prefix:
+            batch = np.hstack([np.broadcast_to(np.array(prefix, dtype=np.intp), (len(batch), len(prefix))), batch])
+        yield batch, uncovered, _popcount(uncovered)
+
+
+def _popcount(values):
+    """Number of set bits in each element of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    counts = np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1)
+    return counts.sum(axis=1)
+
+
+def _summarize(combos, uncovered, counts, n, bound):
+    """
+    Reduce a batch to (covers, fewest, near, evaluated).
+
+    covers lists the combinations covering everyone and fewest is the
+    smallest number of people left uncovered by the others (None if
+    there are none).  near lists the (combo, uncovered) pairs leaving
+    exactly fewest people uncovered, but only when fewest + n can still
+    reach bound; otherwise it is left empty.  evaluated is the number
+    of combinations in the batch.
+    """
+    covers = [tuple(int(g) for g in combos[i]) for i in _positions(counts, 0)]
+    rest = [count for count in counts if count] if isinstance(counts, list) else counts[counts > 0]
+    if not len(rest):
+        return covers, None, [], len(counts)
+    fewest = int(min(rest))
+    if fewest + n > bound:
+        return covers, fewest, [], len(counts)
+    near = [(tuple(int(g) for g in combos[i]), int(uncovered[i])) for i in _positions(counts, fewest)]
+    return covers, fewest, near, len(counts)
+
+
+def _positions(counts, value):
+    """Positions in a batch whose uncovered count equals value."""
+    if isinstance(counts, list):
+        return [i for i, count in enumerate(counts) if count == value]
+    return np.flatnonzero(counts == value)
+
+
+# Each level of a find_gifts(workers=...) sweep is split into about
+# this many shards per worker, but none smaller than BATCH_SIZE.
+SHARDS_PER_WORKER = 8
+
+# State of a find_gifts(workers=...) worker process, set up by
+# _init_shard_worker().
+_SHARD_STATE = {}
+
+
+def _init_shard_worker(masks, full, bound, stop):
+    suffix = [0] * (len(masks) + 1)
+    for i in reversed(range(len(masks))):
+        suffix[i] = suffix[i + 1] | masks[i]
+    _SHARD_STATE.update(
+        masks=masks,
+        full=full,
+        bound=bound,
+        stop=stop,
+        suffix=suffix,
+        batches=_numpy_batches if np is not None and full.bit_length() <= 64 else _int_batches,
+    )
+
+
+def _sweep_shard(n, prefix):
+    """
+    Evaluate every combination of n gifts starting with the gift
+    indices in prefix, in a worker process.
+
+    The shard is skipped when its gifts cannot cover everyone and the
+    people they must leave uncovered already rule out beating the
+    shared bound.  The shard's best near cover score is published to
+    the bound as soon as it is known so that the other workers can
+    prune against it.  The shard is abandoned between batches once the
+    coordinator sets the shared stop event.
+
+    Returns the shard summary in the same (covers, fewest, near,
+    evaluated) form as _summarize().
+    """
+    masks, full, bound, stop, suffix = (_SHARD_STATE[key] for key in ('masks', 'full', 'bound', 'stop', 'suffix'))
+    covers, fewest, near, evaluated = [], None, [], 0
+    reach = functools.reduce(operator.or_, (masks[g] for g in prefix), suffix[prefix[-1] + 1])
+    if reach & full != full and (full & ~reach).bit_count() + n > bound.value:
+        return covers, fewest, near, evaluated
+    for batch in _SHARD_STATE['batches'](masks, full, n, prefix):
+        if stop.is_set():
+            break
+        batch_covers, batch_fewest, batch_near, batch_evaluated = _summarize(*batch, n, bound.value)
+        covers.extend(batch_covers)
+        evaluated += batch_evaluated
+        if batch_fewest is None or (fewest is not None and batch_fewest > fewest):
+            continue
+        if fewest is None or batch_fewest < fewest:
+            fewest, near = batch_fewest, []
+            with bound.get_lock():
+                bound.value = min(bound.value, fewest + n)
+        near.extend(batch_near)
+    if fewest is not None and fewest + n > bound.value:
+        near = []
+    return covers, fewest, near, evaluated
+
+
+def _shard_prefixes(num_gifts, n, target, prefix=()):
+    """
+    Yield the gift index prefixes that split the combinations of n out
+    of num_gifts gifts into shards of at most about target
+    combinations, in lexicographic order.
+
+    Prefixes are extended one gift at a time, and only where they are
+    still too large: the early prefixes hold most of a level, so
+    splitting every shard to the same depth would make thousands of
+    tiny shards for the late ones.
+    """
+    start = prefix[-1] + 1 if prefix else 0
+    for gift in range(start, num_gifts - n + len(prefix) + 1):
+        shard = prefix + (gift,)
+        if len(shard) < n - 1 and math.comb(num_gifts - gift - 1, n - len(shard)) > target:
+            yield from _shard_prefixes(num_gifts, n, target, shard)
+        else:
+            yield shard
+
+
+def _shard_results(futures, monitor):
+    """
+    Yield the results of futures in order, checking monitor while
+    waiting, and stop early when it says so.
+    """
+    for future in futures:
+        while True:
+            try:
+                yield future.result(timeout=PROGRESS_INTERVAL)
+                break
+            except concurrent.futures.TimeoutError:
+                if monitor.stop():
+                    return
+
+
+def _bitmask_covers(gifts, people, masks, monitor, workers=None):
+    """
+    Same search as _brute_force_covers(), but over the gift masks, with
+    each combination reduced to a single uncovered mask.
+
+    Combinations are evaluated in batches, with NumPy when it is
+    installed and there are at most 64 people, and with Python ints
+    otherwise.  monitor is checked between batches.
+
+    With workers, each level is split by gift index prefixes into about
+    SHARDS_PER_WORKER shards per process of a pool of that many
+    processes, so that no shard holds much of the level.  The
+    coordinator seeds a shared near cover bound that the workers tighten
+    and prune against, and merges the shards in prefix order, so the
+    results are the same as with a single process.  When monitor stops
+    the search, a shared event tells the workers to abandon their
+    shards.
+    """
+    full = (1 << len(people)) - 1
+    batches = _numpy_batches if np is not None and len(people) <= 64 else _int_batches
+
+    def near_cover(combo, uncovered):
+        return tuple(gifts[g] for g in combo) + tuple(
+            f'<{person} gift>' for i, person in enumerate(people) if uncovered >> i & 1
+        )
+
+    pool = None
+    if workers is not None:
+        bound = multiprocessing.Value('i', len(people) + len(gifts))
+        stop = multiprocessing.Event()
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_shard_worker, initargs=(masks, full, bound, stop)
+        )
+
+    found = []
+    # Same as in _brute_force_covers().
+    max_near_cover = (len(people), 0, [near_cover((), full)])
+    try:
+        for n in range(2, len(gifts)):
+            LOG.info('Trying combinations of %d gifts out of %d', n, len(gifts))
+            start = time.perf_counter()
+            evaluated = monitor.stats.evaluated
+            # Ties only matter if the best near cover is at this level.
+            best = max_near_cover[0] + max_near_cover[1]
+            if pool is None:
+                summaries = (
+                    _summarize(*batch, n, best if max_near_cover[1] == n else best - 1)
+                    for batch in batches(masks, full, n)
+                )
+            else:
+                with bound.get_lock():
+                    bound.value = best
+                target = max(math.comb(len(gifts), n) // (workers * SHARDS_PER_WORKER), BATCH_SIZE)
+                summaries = _shard_results(
+                    [pool.submit(_sweep_shard, n, prefix) for prefix in _shard_prefixes(len(gifts), n, target)],
+                    monitor,
+                )
+            for covers, fewest, near, batch_evaluated in summaries:
+                if monitor.stop():
+                    break
+                monitor.stats.evaluated += batch_evaluated
+                found.extend(tuple(gifts[g] for g in combo) for combo in covers)
+                if fewest is None:
+                    continue
+                if fewest + n < max_near_cover[0] + max_near_cover[1]:
+                    max_near_cover = (fewest, n, [])
+                elif fewest + n > max_near_cover[0] + max_near_cover[1] or n > max_near_cover[1]:
+                    continue
+                max_near_cover[2].extend(near_cover(combo, uncovered) for combo, uncovered in near)
+            monitor.level(n, monitor.stats.evaluated - evaluated, time.perf_counter() - start)
+            if found or monitor.stopped:
+                break
+            else:
+                # Same as in _brute_force_covers().
+                monitor.bounds(lower=n + 1)
+                if max_near_cover[1] < n:
+                    LOG.info('No more efficient gift combos found at %d gifts.', n)
+                else:
+                    LOG.info('For combinations of %d gifts, the most efficient combos covered all but %d people: %s', max_near_cover[1], max_near_cover[0], max_near_cover[2])
+    finally:
+        if pool is not None:
+            stop.set()
+            pool.shutdown(cancel_futures=True)
+
+    return found
+
+
+_BACKENDS = {
+    'bnb': _branch_and_bound_covers,
+    'sets': _brute_force_covers,
+    'bitmask': _bitmask_covers,
+}
+
+
+def find_gifts(all_gifts=LOVED_GIFTS, backend=None, workers=None, deadline=None, progress=None, cancel=None, stats=None,
+               tier='loved'):
+    """
+    This method finds a set cover (https://en.wikipedia.org/wiki/Set_cover_problem):
+
+    Near-optimal solutions are available (https://github.com/guangtunbenzhu/SetCoverPy).
+
+    The default 'bnb' backend is an exact branch-and-bound search that
+    returns every minimum cover in milliseconds.  The 'sets' backend is
+    the original brute-force approach, kept for comparison: it tries
+    all combinations of n gifts for increasing n and also logs the most
+    efficient near covers along the way.  The 'bitmask' backend runs
+    the same sweep over bitmasks (vectorized with NumPy when it is
+    installed) and gives the same results as 'sets'.
+
+    workers spreads each level of the 'bitmask' sweep across that many
+    processes, and selects that backend unless another is given.
+
+    all_gifts may also be a GiftIndex, whose tier is searched directly
+    from its masks.
+
+    The search can be cut short at deadline (a time.monotonic() value)
+    or when cancel (e.g. a threading.Event) is set.  It always returns
+    the best covers found, or the greedy cover if none beats it, and
+    these may not be minimal if the search was cut short.  progress is
+    called with stats about every PROGRESS_INTERVAL seconds.  Pass a
+    SolveStats as stats to get the counters, the proven bounds on the
+    minimum cover size and whether the covers are proven minimal; it
+    is reset on each call.
+    """
+    if backend is None:
+        backend = 'bnb' if workers is None else 'bitmask'
+    if workers is not None and backend != 'bitmask':
+        raise ValueError(f"workers is only supported by the 'bitmask' backend, not {backend!r}")
+    if stats is None:
+        stats = SolveStats()
+    stats.reset()
+    gifts, people, masks, singletons = _reduce_gifts(all_gifts, stats, tier)
+    monitor = _Monitor(stats, len(singletons), deadline, progress, cancel)
+    full = (1 << len(people)) - 1
+    greedy = _greedy_cover(full, masks)
+    monitor.bounds(
+        lower=_lower_bound(full, (1 << len(masks)) - 1, masks, _candidate_masks(masks, len(people))),
+        upper=len(greedy),
+    )
+    if workers is not None:
+        found = _bitmask_covers(gifts, people, masks, monitor, workers=workers)
+    else:
+        found = _BACKENDS[backend](gifts, people, masks, monitor)
+    # The sweeps start at 2 gifts and stop before all of them, so they
+    # can miss covers the greedy one finds.
+    if not found or len(greedy) < len(found[0]):
+        found = [tuple(gifts[g] for g in greedy)]
+    monitor.bounds(upper=len(found[0]))
+    stats.complete = not monitor.stopped and stats.upper_bound <= stats.lower_bound
+    stats.elapsed = time.monotonic() - monitor.start
+    LOG.debug('find_gifts: %s', stats)
 
     # Add back singletons
     return [combo + tuple(singletons.keys()) for combo in found]
 
-# Full output of the above function with default inputs:
+# Full output of the above function with default inputs, backend='sets' and
+# logging.basicConfig(level=logging.INFO, format='%(message)s'):
 FULL_OUTPUT = '''
 >>> find_gifts()
 Pruning sunflower as only {'haley'} loves it.
@@ -313,3 +1030,256 @@ No more efficient gift combos found at 11 gifts.
 Trying combinations of 12 gifts out of 29
 [('pink cake', 'diamond', 'frog egg', 'amethyst', 'fish taco', 'fiddlehead risotto', 'strawberry', 'duck feather', 'hot pepper', 'cactus fruit', 'goat cheese', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'frog egg', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'hot pepper', 'cactus fruit', 'goat cheese', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'frog egg', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'cactus fruit', 'pepper poppers', 'goat cheese', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'frog egg', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'cactus fruit', 'beer', 'goat cheese', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'frog egg', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'cactus fruit', 'goat cheese', 'pizza', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'amethyst', 'fish taco', 'fiddlehead risotto', 'strawberry', 'duck feather', 'hot pepper', 'cactus fruit', 'goat cheese', 'void egg', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'hot pepper', 'cactus fruit', 'goat cheese', 'void egg', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'cactus fruit', 'pepper poppers', 'goat cheese', 'void egg', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'cactus fruit', 'beer', 'goat cheese', 'void egg', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>'), ('pink cake', 'diamond', 'amethyst', 'green tea', 'fiddlehead risotto', 'strawberry', 'duck feather', 'cactus fruit', 'goat cheese', 'pizza', 'void egg', 'wine', '<george gift>', '<pierre gift>', '<sandy gift>', '<alex gift>', '<wizard gift>')]
 '''
+
+
+def _min_cost_max_flow(num_nodes, edges, source, sink):
+    """
+    Min-cost max-flow by successive shortest paths, using Dijkstra with
+    Johnson potentials.  Edge costs must be non-negative.
+
+    edges is a list of (u, v, capacity, cost).  Returns the flow on each
+    edge, in the same order.
+    """
+    graph = [[] for _ in range(num_nodes)]
+    # Residual edges are stored in pairs: edge 2i is edges[i] and 2i + 1
+    # is its reverse.
+    to, cap, cost = [], [], []
+    for u, v, capacity, edge_cost in edges:
+        for a, b, c, w in ((u, v, capacity, edge_cost), (v, u, 0, -edge_cost)):
+            graph[a].append(len(to))
+            to.append(b)
+            cap.append(c)
+            cost.append(w)
+
+    potential = [0] * num_nodes
+    while True:
+        dist = [math.inf] * num_nodes
+        via = [None] * num_nodes
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in graph[u]:
+                if cap[e] <= 0:
+                    continue
+                v = to[e]
+                nd = d + cost[e] + potential[u] - potential[v]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    via[v] = e
+                    heapq.heappush(heap, (nd, v))
+        if via[sink] is None:
+            break
+        for node in range(num_nodes):
+            if dist[node] < math.inf:
+                potential[node] += dist[node]
+        push = math.inf
+        node = sink
+        while node != source:
+            push = min(push, cap[via[node]])
+            node = to[via[node] ^ 1]
+        node = sink
+        while node != source:
+            cap[via[node]] -= push
+            cap[via[node] ^ 1] += push
+            node = to[via[node] ^ 1]
+
+    return [cap[2 * i + 1] for i in range(len(edges))]
+
+
+# Game limits on gifting each NPC.
+GIFTS_PER_WEEK = 2
+GIFTS_PER_DAY = 1
+
+
+def plan_week(stock, costs=None, weekly_state=None, all_gifts=LOVED_GIFTS, days=7, tier='loved'):
+    """
+    Plan the loved gifts to hand out over the rest of the week.
+
+    stock maps gifts to how many we hold, costs maps gifts to what
+    giving one away costs (0 if missing), and weekly_state maps people
+    to their (GiftsThisWeek, GiftsToday) from friendshipData (no gifts
+    yet if missing).  days is the number of days left in the week,
+    today included.  all_gifts and tier are taken the same way as by
+    find_gifts.
+
+    Unlike find_gifts, every loved gift counts, singletons included.
+    The plan gives as many gifts as the stock and the game's limits
+    allow, at the lowest total cost.  It is solved as a min-cost max
+    flow: source -> gift (capacity stock, cost cost) -> person (for each
+    person loving the gift) -> sink (capacity the gifts the person can
+    still get this week).  Since a person gets at most one gift a day,
+    their gifts are then spread over their first free days.
+
+    Returns a list of (day, person, gift) sorted by day, where day 0 is
+    today.
+    """
+    costs = costs or {}
+    weekly_state = weekly_state or {}
+    index = all_gifts if isinstance(all_gifts, GiftIndex) else build_gift_index({tier: all_gifts})
+    gift_masks = index.tiers[tier]
+    gifts = sorted(gift for gift, mask in gift_masks.items() if mask and stock.get(gift, 0) > 0)
+    people = index.people
+    free_days = {}
+    for person in people:
+        gifts_this_week, gifts_today = weekly_state.get(person, (0, 0))
+        today = [0] if gifts_today < GIFTS_PER_DAY else []
+        free_days[person] = (today + list(range(1, days)))[:max(GIFTS_PER_WEEK - gifts_this_week, 0)]
+
+    # Nodes: source, sink, then gifts, then people.
+    source, sink = 0, 1
+    gift_node = {gift: 2 + i for i, gift in enumerate(gifts)}
+    person_node = {person: 2 + len(gifts) + i for i, person in enumerate(people)}
+    edges = [(source, gift_node[gift], stock[gift], costs.get(gift, 0)) for gift in gifts]
+    loves = []
+    for gift in gifts:
+        for person in (person for i, person in enumerate(people) if gift_masks[gift] >> i & 1):
+            loves.append((gift, person))
+            edges.append((gift_node[gift], person_node[person], GIFTS_PER_WEEK, 0))
+    edges.extend((person_node[person], sink, len(free_days[person]), 0) for person in people)
+
+    flow = _min_cost_max_flow(2 + len(gifts) + len(people), edges, source, sink)
+    given = {person: [] for person in people}
+    for (gift, person), amount in zip(loves, flow[len(gifts):]):
+        given[person].extend([gift] * amount)
+
+    plan = []
+    for person in people:
+        plan.extend(zip(free_days[person], itertools.repeat(person), given[person]))
+    return sorted(plan)
+
+
+def iter_gift_covers(all_gifts=LOVED_GIFTS, limit=None, max_size=None, tier='loved'):
+    """
+    Lazy version of find_gifts, taking all_gifts and tier the same way.
+
+    Returns (gifts, covers): gifts is the list of gift names left after
+    pruning followed by the singleton placeholders, and covers is an
+    iterator over the minimum covers as sorted tuples of indices into
+    gifts.  Singletons are included in every cover.
+
+    The covers are found by iterative deepening: each size from the
+    root lower bound up is searched in full before the next, so the
+    first size with a cover is the optimum and each of its covers is
+    yielded as soon as it is found.  Memory does not grow with the
+    number of tied covers.  The iterator stops after limit covers, or
+    without yielding anything if covers need more than max_size gifts
+    or limit is 0.
+    """
+    if limit is not None and limit < 0:
+        raise ValueError(f'limit must not be negative, not {limit!r}')
+    gifts, people, masks, singletons = _reduce_gifts(all_gifts, tier=tier)
+    gifts.extend(singletons)
+    candidates = _candidate_masks(masks, len(people))
+    full = (1 << len(people)) - 1
+    placeholders = tuple(range(len(masks), len(gifts)))
+
+    def covers():
+        if limit == 0 or (max_size is not None and len(placeholders) > max_size):
+            return
+        lowest = _lower_bound(full, (1 << len(masks)) - 1, masks, candidates)
+        highest = len(_greedy_cover(full, masks))
+        if max_size is not None:
+            highest = min(highest, max_size - len(placeholders))
+        count = 0
+        for size in range(lowest, highest + 1):
+            for cover in _iter_covers_of_size(masks, candidates, full, size):
+                yield tuple(sorted(cover)) + placeholders
+                count += 1
+                if count == limit:
+                    return
+            if count:
+                return
+
+    return gifts, covers()
+
+
+def _max_coverage_combos(masks, candidates, full, k, most):
+    """
+    Every combination of k gifts leaving the fewest people of full
+    uncovered, given that some combination leaves at most most of them
+    uncovered.
+
+    Returns (uncovered, combos) with combos as sorted tuples of gift
+    indices, in index order.
+
+    This is the cover search of _branch_and_bound_covers() with a third
+    kind of branch: after trying each candidate gift of the chosen
+    person, the person is left uncovered, which excludes all of their
+    gifts.  A branch is cut when the largest gains of the gifts left
+    cannot cover enough people, or, once no more people may be left
+    uncovered, by _lower_bound().
+    """
+    best = [most]
+    found = []
+
+    def search(chosen, uncovered, dropped, allowed):
+        left = k - len(chosen)
+        if not uncovered or not left:
+            # Combinations covering everyone with fewer than k gifts
+            # cannot be optimal, as a smaller one would be.
+            total = dropped + uncovered.bit_count()
+            if not left and total <= best[0]:
+                if total < best[0]:
+                    best[0] = total
+                    found.clear()
+                found.append(tuple(sorted(chosen)))
+            return
+        spare = best[0] - dropped
+        gains = heapq.nlargest(left, ((masks[g] & uncovered).bit_count() for g in range(len(masks)) if allowed >> g & 1))
+        if uncovered.bit_count() - sum(gains) > spare:
+            return
+        if not spare:
+            bound = _lower_bound(uncovered, allowed, masks, candidates)
+            if bound is None or bound > left:
+                return
+        person = min(
+            (p for p in range(len(candidates)) if uncovered >> p & 1),
+            key=lambda p: (candidates[p] & allowed).bit_count(),
+        )
+        for gift in sorted(
+            (g for g in range(len(masks)) if (candidates[person] & allowed) >> g & 1),
+            key=lambda g: -(masks[g] & uncovered).bit_count(),
+        ):
+            allowed &= ~(1 << gift)
+            chosen.append(gift)
+            search(chosen, uncovered & ~masks[gift], dropped, allowed)
+            chosen.pop()
+        if dropped < best[0]:
+            # allowed no longer holds any of person's gifts.
+            search(chosen, uncovered & ~(1 << person), dropped + 1, allowed)
+
+    search([], full, 0, (1 << len(masks)) - 1)
+    return best[0], sorted(found)
+
+
+def gift_frontier(all_gifts=LOVED_GIFTS, tier='loved'):
+    """
+    The tradeoff between how many gift types to carry and how many
+    people go without a loved gift.
+
+    Returns a list of (k, uncovered, combos) for k from 1 up to the
+    size of a minimum cover, where uncovered is the fewest people (of
+    those sharing gifts, as in find_gifts) that k gifts can leave out
+    and combos lists every combination of k gifts that does so.  The
+    last entry has uncovered == 0 and the minimum covers as combos.
+    all_gifts and tier are taken the same way as by find_gifts.
+
+    Each k is solved by _max_coverage_combos(), starting from the
+    people the first k gifts of the greedy cover leave out.
+    """
+    gifts, people, masks, singletons = _reduce_gifts(all_gifts, tier=tier)
+    candidates = _candidate_masks(masks, len(people))
+    full = (1 << len(people)) - 1
+
+    frontier = []
+    covered = 0
+    for k, gift in enumerate(_greedy_cover(full, masks), 1):
+        covered |= masks[gift]
+        uncovered, combos = _max_coverage_combos(masks, candidates, full, k, (full & ~covered).bit_count())
+        frontier.append((k, uncovered, [tuple(gifts[g] for g in combo) for combo in combos]))
+        if not uncovered:
+            break
+    return frontier
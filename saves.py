@@ -0,0 +1,498 @@
+#!/usr/bin/env python
+
+from collections import Counter, namedtuple
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+from gifts import GIFTS_PER_WEEK, LOVED_GIFTS, iter_gift_covers, normalize
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+
+# Friendship caps from the stardew 1.6 wiki.  Marriage candidates stop
+# at 8 hearts until you date them, and spouses go up to 14 hearts.
+POINTS_PER_HEART = 250
+MARRIAGE_CANDIDATES = {
+    'abigail', 'alex', 'elliott', 'emily', 'haley', 'harvey', 'leah',
+    'maru', 'penny', 'sam', 'sebastian', 'shane',
+}
+
+# Save folders are named <farm name>_<game id>.
+SAVE_FOLDER = re.compile(r'.+_\d+')
+
+# Parsed saves are cached here by load_save_cached().  The least
+# recently used entries are evicted once the cache is over
+# CACHE_MAX_BYTES.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'stardew-gifts')
+CACHE_MAX_BYTES = 64 << 20
+# Bump when load_save() changes what it extracts, or how it is pickled,
+# to drop old entries.
+CACHE_VERSION = 2
+
+Friendship = namedtuple('Friendship', 'farmer npc points gifts_this_week gifts_today status')
+# farmer is None for items in chests and fridges, which every farmer
+# can reach.
+Item = namedtuple('Item', 'farmer name stack')
+# counts is a Counter of the Names of the objects placed in location.
+Objects = namedtuple('Objects', 'location counts')
+
+
+def max_points(npc, status):
+    """Most friendship points npc can reach with the given Status."""
+    if status == 'Married':
+        return 14 * POINTS_PER_HEART
+    if normalize(npc) in MARRIAGE_CANDIDATES and status != 'Dating':
+        return 8 * POINTS_PER_HEART
+    return 10 * POINTS_PER_HEART
+
+
+def _is_farmer(elem, parent):
+    # SaveGame/player in the main save, Farmer as the root of
+    # SaveGameInfo, and farmhands in cabins (1.6) or SaveGame/farmhands
+    # (older saves).
+    if parent is None:
+        return elem.tag == 'Farmer'
+    return (
+        (elem.tag == 'player' and parent.tag == 'SaveGame')
+        or elem.tag == 'farmhand'
+        or (elem.tag == 'Farmer' and parent.tag == 'farmhands')
+    )
+
+
+def _is_location(elem, parent):
+    # Top-level locations and the interiors of farm buildings.
+    return (elem.tag == 'GameLocation' and parent.tag == 'locations') or elem.tag == 'indoors'
+
+
+def _is_storage(elem):
+    # Chests placed in the world or carried, and house fridges.
+    return elem.tag == 'fridge' or elem.get(XSI_TYPE) == 'Chest'
+
+
+def iter_save(path):
+    """
+    Stream the Friendship, Item and Objects records out of a save file.
+
+    Works on both the main save and SaveGameInfo.  The document is read
+    with iterparse and every element is cleared and detached as soon as
+    it has been handled, so memory only holds the record being read and
+    the chain of its ancestors, however large the save is.
+
+    Yields Friendship records for each farmer's friendshipData, and Item
+    records for farmer inventories (with the farmer's name) and for
+    chests and fridges (with farmer None).  Each location with placed
+    objects yields one Objects record once the location has been read.
+    """
+    stack = []
+    farmers = []
+    locations = []
+    records = 0
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            parent = stack[-1] if stack else None
+            if _is_farmer(elem, parent):
+                farmers.append([elem, None])
+            elif parent is not None and _is_location(elem, parent):
+                locations.append([elem, None, Counter()])
+            stack.append(elem)
+            if _is_record(stack):
+                records += 1
+            continue
+
+        record = _is_record(stack)
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if farmers and parent is farmers[-1][0] and elem.tag == 'name':
+            farmers[-1][1] = elem.text
+        elif locations and parent is locations[-1][0] and elem.tag == 'name':
+            locations[-1][1] = elem.text
+        elif farmers and elem is farmers[-1][0]:
+            farmers.pop()
+        elif locations and elem is locations[-1][0]:
+            _, name, counts = locations.pop()
+            if counts:
+                yield Objects(location=name, counts=counts)
+        elif record:
+            records -= 1
+            yield from _read_record(elem, stack, farmers, locations)
+
+        if not records:
+            elem.clear()
+            if parent is not None:
+                parent.remove(elem)
+
+
+def _is_record(stack):
+    """Whether the innermost element of stack is a record iter_save() reads."""
+    if len(stack) < 3:
+        return False
+    elem, container = stack[-1], stack[-2]
+    if elem.tag == 'item' and container.tag == 'friendshipData':
+        return True
+    if elem.tag == 'Object' and container.tag == 'value':
+        return len(stack) >= 4 and stack[-4].tag == 'objects'
+    return elem.tag == 'Item' and container.tag == 'items'
+
+
+def _read_record(elem, stack, farmers, locations):
+    owner = stack[-2]
+    farmer = farmers[-1][1] if farmers else None
+    if elem.tag == 'Object':
+        if locations and elem.findtext('Name') is not None:
+            locations[-1][2][elem.findtext('Name')] += 1
+    elif elem.tag == 'item':
+        if farmers and owner is farmers[-1][0]:
+            friendship = elem.find('value/Friendship')
+            yield Friendship(
+                farmer=farmer,
+                npc=elem.findtext('key/string'),
+                points=int(friendship.findtext('Points', '0')),
+                gifts_this_week=int(friendship.findtext('GiftsThisWeek', '0')),
+                gifts_today=int(friendship.findtext('GiftsToday', '0')),
+                status=friendship.findtext('Status'),
+            )
+    elif elem.findtext('Name') is not None:
+        if farmers and owner is farmers[-1][0]:
+            yield Item(farmer=farmer, name=elem.findtext('Name'), stack=int(elem.findtext('Stack', '1')))
+        elif _is_storage(owner):
+            yield Item(farmer=None, name=elem.findtext('Name'), stack=int(elem.findtext('Stack', '1')))
+
+
+def load_save(path):
+    """
+    Collect the records of iter_save() into a small summary:
+
+        {
+            'farmers': {name: {'friendships': {npc: Friendship}, 'inventory': Counter}},
+            'storage': Counter,
+            'objects': {location: Counter},
+        }
+
+    Item counters are keyed by normalize()d name, object counters by
+    the in-game Name.
+    """
+    state = {'farmers': {}, 'storage': Counter(), 'objects': {}}
+
+    def farmer_state(name):
+        return state['farmers'].setdefault(name, {'friendships': {}, 'inventory': Counter()})
+
+    for record in iter_save(path):
+        if isinstance(record, Friendship):
+            farmer_state(record.farmer)['friendships'][record.npc] = record
+        elif isinstance(record, Objects):
+            state['objects'].setdefault(record.location, Counter()).update(record.counts)
+        elif record.farmer is None:
+            state['storage'][normalize(record.name)] += record.stack
+        else:
+            farmer_state(record.farmer)['inventory'][normalize(record.name)] += record.stack
+    return state
+
+
+def owned_items(state, farmer):
+    """Counter of the items farmer holds or can take from storage."""
+    return state['farmers'][farmer]['inventory'] + state['storage']
+
+
+def gift_table(state, farmer, all_gifts=LOVED_GIFTS, owned_only=True, weekly=True):
+    """
+    Restrict all_gifts to what farmer can act on this week, for use as
+    find_gifts(gift_table(...)).
+
+    NPCs are kept if they are below their max_points() and, unless
+    weekly is false, have had fewer than GIFTS_PER_WEEK gifts this week.
+    NPCs the farmer has never met are kept too.  Unless owned_only is
+    false, each NPC keeps only the loved gifts the farmer holds or has
+    in storage; NPCs left with none get a singleton placeholder from
+    find_gifts.
+    """
+    owned = owned_items(state, farmer)
+    friendships = {normalize(npc): friendship for npc, friendship in state['farmers'][farmer]['friendships'].items()}
+    table = {}
+    for person, loved_gifts in all_gifts.items():
+        friendship = friendships.get(person)
+        if friendship is not None and (
+            friendship.points >= max_points(person, friendship.status)
+            or (weekly and friendship.gifts_this_week >= GIFTS_PER_WEEK)
+        ):
+            continue
+        table[person] = [gift for gift in loved_gifts if owned[gift] or not owned_only]
+    return table
+
+
+def weekly_state(state, farmer):
+    """
+    Map farmer's NPCs to their (GiftsThisWeek, GiftsToday), for use as
+    plan_week(owned_items(...), weekly_state=weekly_state(...)).
+
+    NPCs at their max_points() are reported as having had all their
+    gifts this week, so the planner leaves them out.
+    """
+    return {
+        normalize(npc): (
+            GIFTS_PER_WEEK if friendship.points >= max_points(npc, friendship.status) else friendship.gifts_this_week,
+            friendship.gifts_today,
+        )
+        for npc, friendship in state['farmers'][farmer]['friendships'].items()
+    }
+
+
+def save_files(root='.'):
+    """
+    List the save files in every save folder under root: the main save,
+    SaveGameInfo, and their _old and ~ backups.
+    """
+    paths = []
+    for folder in sorted(os.listdir(root)):
+        if not SAVE_FOLDER.fullmatch(folder) or not os.path.isdir(os.path.join(root, folder)):
+            continue
+        for name in (folder, f'{folder}_old', f'{folder}~', 'SaveGameInfo', 'SaveGameInfo_old'):
+            path = os.path.join(root, folder, name)
+            if os.path.isfile(path):
+                paths.append(path)
+    return paths
+
+
+def _file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _read_entry(entry_path):
+    try:
+        with open(entry_path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Truncated or written by an incompatible version: reparse.
+        LOG.warning('Ignoring unreadable cache entry %s', entry_path)
+        return None
+
+
+def _write_entry(entry_path, entry, cache_dir, max_bytes):
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, entry_path)
+    _evict(cache_dir, max_bytes)
+
+
+def _evict(cache_dir, max_bytes):
+    """
+    Remove the least recently used entries until the cache fits in
+    max_bytes.  Entries that another process removes meanwhile are
+    skipped.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pickle'):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        LOG.debug('Evicting cache entry %s', name)
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_save_cached(path, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """
+    load_save() with an on-disk cache of the parsed state.
+
+    The entry for path is reused as is while the file's size and mtime
+    match.  Otherwise the file is hashed, and only parsed again if the
+    hash changed too, so a save copied or touched without changes is
+    not reparsed.  Entries are pickles named after the hash of the
+    path; reading one marks it as recently used for eviction.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    entry_path = os.path.join(cache_dir, hashlib.sha1(path.encode()).hexdigest() + '.pickle')
+    entry = _read_entry(entry_path)
+    if entry is not None and entry['path'] == path and entry.get('version') == CACHE_VERSION:
+        if (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            try:
+                os.utime(entry_path)
+            except FileNotFoundError:
+                # Evicted by another process since it was read.
+                pass
+            return entry['state']
+        digest = _file_hash(path)
+        if entry['sha1'] == digest:
+            entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            _write_entry(entry_path, entry, cache_dir, max_bytes)
+            return entry['state']
+    else:
+        digest = _file_hash(path)
+
+    LOG.debug('Parsing %s', path)
+    state = load_save(path)
+    entry = {'version': CACHE_VERSION, 'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest, 'state': state}
+    _write_entry(entry_path, entry, cache_dir, max_bytes)
+    return state
+
+
+def load_saves(root='.', cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """Map every path from save_files(root) to its load_save_cached() state."""
+    return {path: load_save_cached(path, cache_dir, max_bytes) for path in save_files(root)}
+
+
+def save_pair(folder):
+    """
+    The (current, old) files to compare for a save folder: the main
+    save and its _old backup, or SaveGameInfo and SaveGameInfo_old for
+    folders without a main save.  old is None if there is no backup.
+    """
+    name = os.path.basename(os.path.normpath(folder))
+    for current, old in ((name, f'{name}_old'), ('SaveGameInfo', 'SaveGameInfo_old')):
+        current, old = os.path.join(folder, current), os.path.join(folder, old)
+        if os.path.isfile(current):
+            return current, old if os.path.isfile(old) else None
+    return None
+
+
+def _analyze_file(path, use_cache, cache_dir, cover=True):
+    """
+    Parse one save in a worker process and, if cover is true, find a
+    minimum loved-gift cover for each farmer's NPCs that are not yet at
+    max hearts, whatever they were given this week.
+
+    Returns (path, state, covers, seconds), with covers None unless
+    cover is true.
+    """
+    start = time.perf_counter()
+    state = load_save_cached(path, cache_dir) if use_cache else load_save(path)
+    covers = None
+    if cover:
+        covers = {}
+        for farmer in state['farmers']:
+            gifts, found = iter_gift_covers(gift_table(state, farmer, owned_only=False, weekly=False), limit=1)
+            covers[farmer] = [gifts[i] for i in next(found, ())]
+    return path, state, covers, time.perf_counter() - start
+
+
+def _farmer_report(folder, farmer, current, old, covers, seconds):
+    friendships = current['farmers'][farmer]['friendships']
+    before = old['farmers'].get(farmer, {'friendships': {}})['friendships'] if old else {}
+    return {
+        'save': os.path.basename(os.path.normpath(folder)),
+        'farmer': farmer,
+        'seconds': seconds,
+        'friendships': {
+            npc: {
+                'points': friendship.points,
+                'hearts': friendship.points // POINTS_PER_HEART,
+                'max_points': max_points(npc, friendship.status),
+                'gifts_this_week': friendship.gifts_this_week,
+                'gifts_today': friendship.gifts_today,
+                'status': friendship.status,
+            }
+            for npc, friendship in friendships.items()
+        },
+        'cover': covers[farmer],
+        'deltas': {
+            npc: friendship.points - (before[npc].points if npc in before else 0)
+            for npc, friendship in friendships.items()
+        } if old else None,
+    }
+
+
+def main(argv=None):
+    """
+    Analyze every save folder under root and print one JSON line per
+    farmer as soon as both files of its save have been parsed.
+
+    Each line has the farmer's friendships, a minimum cover of loved
+    gifts for the NPCs not yet at max hearts, the friendship point
+    deltas since the _old backup (null without one), and the parse
+    time of each file in seconds.  A save that fails to parse gets one
+    line with its path and the error instead, and the exit status is 1.
+    """
+    parser = argparse.ArgumentParser(description='Analyze every save folder and print JSON lines.')
+    parser.add_argument('root', nargs='?', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--workers', type=int, default=None, help='processes to parse with (default: all cores)')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the saves from scratch')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    folders = sorted(
+        os.path.join(args.root, folder) for folder in os.listdir(args.root)
+        if SAVE_FOLDER.fullmatch(folder) and os.path.isdir(os.path.join(args.root, folder))
+    )
+    pairs = {folder: save_pair(folder) for folder in folders}
+    pending = {}
+    status = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for folder, pair in pairs.items():
+            if pair is None:
+                LOG.warning('No save found in %s', folder)
+                continue
+            current, old = pair
+            for path in pair:
+                if path is not None:
+                    pending.setdefault(folder, {})[path] = None
+                    # Only the current save's covers are reported.
+                    future = pool.submit(_analyze_file, path, not args.no_cache, args.cache_dir, path == current)
+                    futures[future] = path
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                path, state, covers, seconds = future.result()
+            except Exception as e:
+                path = futures[future]
+                folder = os.path.dirname(path)
+                LOG.warning('Could not analyze %s: %s', path, e)
+                # Report the save once, and drop the rest of its files.
+                if pending.pop(folder, None) is not None:
+                    error = {'save': os.path.basename(os.path.normpath(folder)), 'path': path, 'error': f'{type(e).__name__}: {e}'}
+                    print(json.dumps(error), flush=True)
+                status = 1
+                continue
+            folder = os.path.dirname(path)
+            if folder not in pending:
+                continue
+            results = pending[folder]
+            results[path] = (state, covers, seconds)
+            if any(result is None for result in results.values()):
+                continue
+            current, old = pairs[folder]
+            state, covers, current_seconds = results[current]
+            old_state, _, old_seconds = results[old] if old else (None, None, None)
+            for farmer in state['farmers']:
+                report = _farmer_report(
+                    folder, farmer, state, old_state, covers,
+                    {os.path.basename(current): current_seconds, **({os.path.basename(old): old_seconds} if old else {})},
+                )
+                print(json.dumps(report), flush=True)
+    return status
+
+
+if __name__ == '__main__':
+    # Run the imported module rather than __main__, so that cached saves
+    # pickle saves.Friendship and friends and load from any importer.
+    from saves import main
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#
+# Tests for gifts.py and saves.py.  Run with:
+#
+#   python -m pytest -q
+
+import itertools
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import gifts
+import saves
+from bench_gifts import golden_covers, same_covers, synthetic_table
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+TABLES = [
+    synthetic_table(12, 30, 0.15, seed=1),
+    synthetic_table(16, 40, 0.1, seed=2),
+    synthetic_table(20, 40, 0.08, seed=3),
+]
+
+
+@pytest.mark.parametrize('table', TABLES)
+def test_backends_agree(table):
+    expected = gifts.find_gifts(table, backend='sets')
+    for backend in ('bnb', 'bitmask'):
+        assert same_covers(gifts.find_gifts(table, backend=backend), expected, table), backend
+
+
+@pytest.mark.parametrize('table', TABLES)
+def test_workers_agree(table):
+    expected = gifts.find_gifts(table, backend='bitmask')
+    assert same_covers(gifts.find_gifts(table, workers=2), expected, table)
+
+
+@pytest.mark.parametrize('table', TABLES)
+def test_iter_gift_covers(table):
+    names, covers = gifts.iter_gift_covers(table)
+    found = [[names[i] for i in cover] for cover in covers]
+    assert same_covers(found, gifts.find_gifts(table), table)
+
+
+@pytest.mark.parametrize('table', TABLES)
+def test_gift_frontier(table):
+    names, people, masks, singletons = gifts._reduce_gifts(table)
+    full = (1 << len(people)) - 1
+    frontier = gifts.gift_frontier(table)
+    assert frontier[-1][1] == 0
+    for k, uncovered, combos in frontier:
+        left = {}
+        for combo in itertools.combinations(range(len(masks)), k):
+            covered = 0
+            for gift in combo:
+                covered |= masks[gift]
+            left.setdefault((full & ~covered).bit_count(), []).append(combo)
+        assert uncovered == min(left)
+        expected = {frozenset(names[gift] for gift in combo) for combo in left[uncovered]}
+        assert {frozenset(combo) for combo in combos} == expected
+
+
+def test_loved_gifts_golden():
+    golden = golden_covers()
+    assert same_covers(gifts.find_gifts(), golden)
+    names, covers = gifts.iter_gift_covers()
+    assert same_covers([[names[i] for i in cover] for cover in covers], golden)
+
+
+def test_plan_week():
+    # a and c have one gift left this week and b already had one today.
+    # Only a loves y, so the costly y still goes to a to give the most
+    # gifts, and x waits for b until tomorrow.
+    table = {'a': ['x', 'y'], 'b': ['x'], 'c': ['z']}
+    stock = {'x': 1, 'y': 1, 'z': 2}
+    week = {'a': (1, 0), 'b': (1, 1), 'c': (1, 0)}
+    plan = gifts.plan_week(stock, costs={'y': 5}, weekly_state=week, all_gifts=table)
+    assert plan == [(0, 'a', 'y'), (0, 'c', 'z'), (1, 'b', 'x')]
+    index = gifts.build_gift_index({'loved': table})
+    assert gifts.plan_week(stock, costs={'y': 5}, weekly_state=week, all_gifts=index) == plan
+
+
+def test_iter_save():
+    path = os.path.join(HERE, 'vanillabaklava_340072055', 'vanillabaklava_340072055')
+    player = ET.parse(path).getroot().find('player')
+    farmer = player.findtext('name')
+    expected = {
+        item.findtext('key/string'): int(item.findtext('value/Friendship/Points'))
+        for item in player.find('friendshipData')
+    }
+    records = list(saves.iter_save(path))
+    found = {
+        record.npc: record.points
+        for record in records if isinstance(record, saves.Friendship) and record.farmer == farmer
+    }
+    assert found == expected
+    assert any(isinstance(record, saves.Item) and record.farmer == farmer for record in records)
+    assert any(isinstance(record, saves.Objects) and record.location == 'Farm' for record in records)